@@ -6,30 +6,70 @@ Tự động start TCP và UDP servers trên máy remote
 
 import asyncio
 import socket
-import threading
 import argparse
+import multiprocessing
+import os
 import sys
 import signal
 from tcp_benchmark import TCPBenchmark
-from udp_benchmark import UDPBenchmark
+from udp_benchmark import UDPBenchmark, tune_udp_socket
+from mmsg import DatagramEchoBatch, MMSG_AVAILABLE
+from uring import UringDatagramEcho
+from common import install_uvloop
+
+install_uvloop()
+
+class EchoUDP(asyncio.DatagramProtocol):
+    """Echoes every full-size datagram back from the event loop"""
+    def __init__(self, data_size):
+        self.data_size = data_size
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data, addr):
+        if len(data) == self.data_size:
+            self.transport.sendto(data, addr)
+    
+    def error_received(self, exc):
+        print(f"❌ UDP Server error: {exc}")
 
 class RemoteServer:
-    def __init__(self, host='0.0.0.0', tcp_port=8888, udp_port=8889, data_size=1024, iterations=1000):
+    def __init__(self, host='0.0.0.0', tcp_port=8888, udp_port=8889, data_size=1024, iterations=1000,
+                 iouring=False, tcp_workers=1):
         self.host = host
         self.tcp_port = tcp_port
         self.udp_port = udp_port
         self.data_size = data_size
         self.iterations = iterations
-        self.running = True
-        
-        # Setup signal handlers
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
+        self.iouring = iouring
+        self.tcp_workers = tcp_workers or os.cpu_count() or 1
+        if self.tcp_workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            print("⚠️ SO_REUSEPORT not supported on this platform, using a single TCP worker")
+            self.tcp_workers = 1
+        self._udp_sock = None  # Bound by udp_server(), absent in TCP-only workers
+        self._udp_transport = None  # EchoUDP fallback owns the socket through its transport
+        self._uring_echo = None
     
-    def signal_handler(self, signum, frame):
+    def signal_handler(self, signum, task):
         """Handle shutdown signals"""
         print(f"\n🛑 Received signal {signum}, shutting down servers...")
-        self.running = False
+        task.cancel()
+    
+    async def serve_tcp(self):
+        """Run tcp_server until SIGINT/SIGTERM cancels it, so the listener is closed on the way out"""
+        task = asyncio.ensure_future(self.tcp_server())
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.signal_handler, signum, task)
+            except NotImplementedError:  # Windows: Ctrl+C still raises KeyboardInterrupt
+                pass
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
     
     async def tcp_server(self):
         """Async TCP server"""
@@ -37,8 +77,11 @@ class RemoteServer:
         
         benchmark = TCPBenchmark(self.host, self.tcp_port, self.data_size, self.iterations)
         
+        # With several workers each process binds its own listener on the same port
+        # and the kernel load-balances incoming connections between them
         server = await asyncio.start_server(
-            benchmark.handle_client, self.host, self.tcp_port
+            benchmark.handle_client, self.host, self.tcp_port,
+            reuse_port=self.tcp_workers > 1, backlog=4096
         )
         
         print(f"✅ TCP Server ready on {self.host}:{self.tcp_port}")
@@ -46,35 +89,67 @@ class RemoteServer:
         async with server:
             await server.serve_forever()
     
-    def udp_server(self):
-        """UDP server"""
+    async def udp_server(self):
+        """UDP server running on the same event loop as the TCP server"""
         print(f"🌐 Starting UDP Server on {self.host}:{self.udp_port}")
         
         benchmark = UDPBenchmark(self.host, self.udp_port, self.data_size, self.iterations)
-        benchmark.server_running = True
+        loop = asyncio.get_running_loop()
         
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        tune_udp_socket(sock)
         sock.bind((self.host, self.udp_port))
+        self._udp_sock = sock  # Reader callbacks only hold the fd, keep the socket alive
         
-        print(f"✅ UDP Server ready on {self.host}:{self.udp_port}")
+        # Optional io_uring echo (Linux 6.0+), socket paths are the fallback
+        uring_echo = None
+        if self.iouring:
+            try:
+                uring_echo = UringDatagramEcho(sock, self.data_size, benchmark.test_data)
+            except OSError as e:
+                print(f"⚠️ io_uring unavailable, using socket loop: {e}")
+        self._uring_echo = uring_echo
         
+        if uring_echo is not None:
+            # The ring fd turns readable whenever completions are waiting
+            loop.add_reader(uring_echo.ring.fd, self._udp_ready, uring_echo.echo, 0)
+            uring_echo.echo(0)  # Serve datagrams that arrived during setup
+            print("⚡ UDP Server using io_uring")
+        elif MMSG_AVAILABLE:
+            # Batch up to 64 datagrams per syscall where libc has recvmmsg/sendmmsg
+            batch = DatagramEchoBatch(self.data_size)
+            loop.add_reader(sock.fileno(), self._udp_ready, batch.echo, sock.fileno(), 0)
+        else:
+            self._udp_transport, _ = await loop.create_datagram_endpoint(
+                lambda: EchoUDP(self.data_size), sock=sock
+            )
+        
+        print(f"✅ UDP Server ready on {self.host}:{self.udp_port}")
+    
+    def stop_udp_server(self):
+        """Stop serving UDP and release the socket and the io_uring ring"""
+        loop = asyncio.get_running_loop()
+        if self._uring_echo is not None:
+            loop.remove_reader(self._uring_echo.ring.fd)
+            self._uring_echo.ring.close()
+            self._uring_echo = None
+        if self._udp_transport is not None:
+            self._udp_transport.close()  # Closes the socket too
+            self._udp_transport = None
+        elif self._udp_sock is not None:
+            loop.remove_reader(self._udp_sock.fileno())
+            self._udp_sock.close()
+        self._udp_sock = None
+    
+    def _udp_ready(self, echo, *args):
+        """Event loop reader callback: serve the datagrams queued so far"""
         try:
-            while self.running and benchmark.server_running:
-                try:
-                    data, addr = sock.recvfrom(self.data_size)
-                    if len(data) == self.data_size:
-                        sock.sendto(benchmark.test_data, addr)
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    if self.running:
-                        print(f"❌ UDP Server error: {e}")
-                    break
-        except KeyboardInterrupt:
+            echo(*args)
+        except BlockingIOError:
             pass
-        finally:
-            sock.close()
-            print("🛑 UDP Server stopped")
+        except OSError as e:
+            print(f"❌ UDP Server error: {e}")
     
     async def run_servers(self):
         """Run both TCP and UDP servers"""
@@ -86,22 +161,31 @@ class RemoteServer:
         print(f"📊 Data size: {self.data_size} bytes")
         print("="*50)
         
-        # Start UDP server in background thread
-        udp_thread = threading.Thread(target=self.udp_server)
-        udp_thread.daemon = True
-        udp_thread.start()
+        # UDP is served by callbacks on this event loop, no thread needed
+        await self.udp_server()
         
-        # Wait a bit for UDP server to start
-        await asyncio.sleep(1)
+        # Extra TCP worker processes, each with its own event loop
+        for _ in range(self.tcp_workers - 1):
+            worker = multiprocessing.Process(
+                target=run_tcp_worker,
+                args=(self.host, self.tcp_port, self.data_size, self.iterations, self.tcp_workers),
+                daemon=True
+            )
+            worker.start()
         
-        # Start TCP server in main thread
+        # Start TCP server in main thread; daemon workers exit with this process
         try:
-            await self.tcp_server()
-        except KeyboardInterrupt:
-            pass
+            await self.serve_tcp()
         finally:
-            self.running = False
+            self.stop_udp_server()
             print("🛑 TCP Server stopped")
+            print("🛑 UDP Server stopped")
+
+def run_tcp_worker(host, tcp_port, data_size, iterations, tcp_workers):
+    """Entry point of an extra TCP server process sharing the port via SO_REUSEPORT"""
+    server = RemoteServer(host=host, tcp_port=tcp_port, data_size=data_size,
+                          iterations=iterations, tcp_workers=tcp_workers)
+    asyncio.run(server.serve_tcp())
 
 def main():
     parser = argparse.ArgumentParser(
@@ -117,6 +201,9 @@ Examples:
   
   # Start servers on specific host
   python benchmark_remote_server.py --host 127.0.0.1
+  
+  # Serve TCP from one process per CPU core
+  python benchmark_remote_server.py --tcp-workers 0
         """
     )
     
@@ -130,6 +217,10 @@ Examples:
                        help='Data size in bytes (default: 1024 = 1KiB)')
     parser.add_argument('--iterations', type=int, default=1000,
                        help='Number of iterations (default: 1000)')
+    parser.add_argument('--iouring', action='store_true',
+                       help='Serve UDP through io_uring (Linux 6.0+, falls back to sockets)')
+    parser.add_argument('--tcp-workers', type=int, default=1,
+                       help='TCP server processes sharing the port via SO_REUSEPORT, 0 = one per CPU (default: 1)')
     
     args = parser.parse_args()
     
@@ -138,7 +229,9 @@ Examples:
         tcp_port=args.tcp_port,
         udp_port=args.udp_port,
         data_size=args.data_size,
-        iterations=args.iterations
+        iterations=args.iterations,
+        iouring=args.iouring,
+        tcp_workers=args.tcp_workers
     )
     
     try:
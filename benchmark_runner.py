@@ -5,24 +5,40 @@ Benchmarks Async TCP Socket and UDP Socket performance for both local and remote
 """
 
 import asyncio
-import time
 import argparse
 import sys
-import socket
 import subprocess
 import platform
-import threading
 from tcp_benchmark import TCPBenchmark
 from udp_benchmark import UDPBenchmark
-from common import print_comparison_table, create_benchmark_result
+from common import print_comparison_table, create_benchmark_result, install_uvloop
+
+install_uvloop()
+
+PROBE_TIMEOUT = 2.0  # Seconds allowed for each connectivity probe
 
 class UnifiedBenchmark:
-    def __init__(self, host='localhost', tcp_port=8888, udp_port=8889, data_size=1024, iterations=1000):
+    def __init__(self, host='localhost', tcp_port=8888, udp_port=8889, data_size=1024, iterations=1000, zerocopy=False,
+                 pipeline=1, ping=False, pace_interval=0, batch_size=1,
+                 busy_poll=0, client_cpu=None, server_cpu=None, nice=0, window=1,
+                 debug=False, iouring=False):
         self.host = host
         self.tcp_port = tcp_port
         self.udp_port = udp_port
         self.data_size = data_size
         self.iterations = iterations
+        self.zerocopy = zerocopy
+        self.pipeline = pipeline
+        self.ping = ping
+        self.pace_interval = pace_interval
+        self.batch_size = batch_size
+        self.busy_poll = busy_poll
+        self.client_cpu = client_cpu
+        self.server_cpu = server_cpu
+        self.nice = nice
+        self.window = window
+        self.debug = debug
+        self.iouring = iouring
         
     def check_network_connectivity(self):
         """Kiểm tra kết nối mạng cho remote benchmark"""
@@ -31,7 +47,14 @@ class UnifiedBenchmark:
             
         print("🔍 Kiểm tra kết nối mạng...")
         
-        # Test ping
+        # Ping is opt-in, the subprocess alone costs 100-2000 ms even on success
+        if self.ping and not self.check_ping():
+            return False
+        
+        return asyncio.run(self.probe_ports())
+    
+    def check_ping(self):
+        """Ping the host with the system ping command"""
         try:
             if platform.system().lower() == "windows":
                 cmd = ["ping", "-n", "2", self.host]
@@ -47,32 +70,46 @@ class UnifiedBenchmark:
         except Exception as e:
             print(f"❌ Lỗi ping: {e}")
             return False
+        return True
+    
+    async def probe_ports(self):
+        """Probe the TCP and UDP ports concurrently"""
+        loop = asyncio.get_running_loop()
+        
+        async def probe_tcp():
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.tcp_port),
+                timeout=PROBE_TIMEOUT
+            )
+            writer.close()
+            await writer.wait_closed()
+        
+        async def probe_udp():
+            transport, _ = await asyncio.wait_for(
+                loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                              remote_addr=(self.host, self.udp_port)),
+                timeout=PROBE_TIMEOUT
+            )
+            transport.sendto(b"test")
+            transport.close()
+        
+        tcp_error, udp_error = await asyncio.gather(probe_tcp(), probe_udp(), return_exceptions=True)
         
         # Test TCP port
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)
-            result = sock.connect_ex((self.host, self.tcp_port))
-            sock.close()
-            
-            if result == 0:
-                print(f"✅ TCP port {self.tcp_port} có thể kết nối")
-            else:
-                print(f"❌ TCP port {self.tcp_port} không thể kết nối")
-                return False
-        except Exception as e:
-            print(f"❌ Lỗi test TCP port: {e}")
+        if tcp_error is None:
+            print(f"✅ TCP port {self.tcp_port} có thể kết nối")
+        elif isinstance(tcp_error, (OSError, asyncio.TimeoutError)):
+            print(f"❌ TCP port {self.tcp_port} không thể kết nối")
+            return False
+        else:
+            print(f"❌ Lỗi test TCP port: {tcp_error}")
             return False
         
         # Test UDP port
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(5)
-            sock.sendto(b"test", (self.host, self.udp_port))
-            sock.close()
+        if udp_error is None:
             print(f"✅ UDP port {self.udp_port} có thể kết nối")
-        except Exception as e:
-            print(f"⚠️ UDP port {self.udp_port} có thể không hoạt động: {e}")
+        else:
+            print(f"⚠️ UDP port {self.udp_port} có thể không hoạt động: {udp_error}")
         
         return True
     
@@ -80,7 +117,8 @@ class UnifiedBenchmark:
         """Run TCP benchmark (local or remote)"""
         print(f"\n🔌 Chạy TCP benchmark đến {self.host}:{self.tcp_port}")
         
-        benchmark = TCPBenchmark(self.host, self.tcp_port, self.data_size, self.iterations)
+        benchmark = TCPBenchmark(self.host, self.tcp_port, self.data_size, self.iterations,
+                                 zerocopy=self.zerocopy, pipeline=self.pipeline)
         
         if self.host == 'localhost':
             # Local mode: start server + run client
@@ -104,38 +142,35 @@ class UnifiedBenchmark:
             return asyncio.run(run_local())
         else:
             # Remote mode: only run client (server should be running elsewhere)
-            async def run_remote():
-                print(f"✅ Connecting to remote TCP server at {self.host}:{self.tcp_port}")
-                await benchmark.tcp_client()
-                benchmark.print_results()
-                return create_benchmark_result(benchmark, "TCP")
-            
-            return asyncio.run(run_remote())
+            # No local server shares this thread, so the blocking client can be used
+            print(f"✅ Connecting to remote TCP server at {self.host}:{self.tcp_port}")
+            benchmark.tcp_client_sync()
+            benchmark.print_results()
+            return create_benchmark_result(benchmark, "TCP")
     
     def run_udp_benchmark(self):
         """Run UDP benchmark (local or remote)"""
         print(f"\n📡 Chạy UDP benchmark đến {self.host}:{self.udp_port}")
         
-        benchmark = UDPBenchmark(self.host, self.udp_port, self.data_size, self.iterations)
+        benchmark = UDPBenchmark(self.host, self.udp_port, self.data_size, self.iterations,
+                                 zerocopy=self.zerocopy, pace_interval=self.pace_interval, batch_size=self.batch_size,
+                                 busy_poll=self.busy_poll, client_cpu=self.client_cpu,
+                                 server_cpu=self.server_cpu, nice=self.nice, window=self.window,
+                                 debug=self.debug, iouring=self.iouring)
         
         if self.host == 'localhost':
             # Local mode: start server + run client
-            # Start server in background thread
-            server_thread = threading.Thread(target=benchmark.udp_server)
-            server_thread.daemon = True
-            server_thread.start()
+            # Start server in a separate process
+            benchmark.start_server_process()
             
-            # Wait a bit for server to start
-            time.sleep(1)
+            # Wait for the server socket to be bound
+            benchmark.wait_server_ready()
             
             # Run client
             benchmark.udp_client()
             
             # Stop server
-            benchmark.server_running = False
-            
-            # Wait for server to stop
-            server_thread.join(timeout=2)
+            benchmark.stop_server_process()
             
             # Print results and return
             benchmark.print_results()
@@ -213,6 +248,30 @@ Examples:
                        help='Run UDP benchmark only')
     parser.add_argument('--compare', action='store_true',
                        help='Run both TCP and UDP benchmarks and compare')
+    parser.add_argument('--zerocopy', action='store_true',
+                       help='Send remote TCP payloads and local UDP server replies with MSG_ZEROCOPY (Linux)')
+    parser.add_argument('--pipeline', type=int, default=1, metavar='K',
+                       help='TCP requests in flight before reading replies (default: 1)')
+    parser.add_argument('--ping', action='store_true',
+                       help='Also ping the remote host before benchmarking')
+    parser.add_argument('--pace-interval', type=float, default=0, metavar='SECONDS',
+                       help='Minimum time between UDP request starts (default: 0 = no pacing)')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N',
+                       help='UDP requests per sendmmsg/recvmmsg call, Linux only (default: 1)')
+    parser.add_argument('--window', type=int, default=1, metavar='W',
+                       help='Sequence-tagged UDP requests in flight, timed per datagram (default: 1)')
+    parser.add_argument('--debug', action='store_true',
+                       help='Check every UDP reply size inside the timed loop')
+    parser.add_argument('--iouring', action='store_true',
+                       help='Run the UDP client send/receive through io_uring (Linux 6.1+, falls back to sockets)')
+    parser.add_argument('--busy-poll', type=int, default=0, metavar='USEC',
+                       help='SO_BUSY_POLL time for the UDP sockets, Linux only (default: 0 = off)')
+    parser.add_argument('--client-cpu', type=int, metavar='CPU',
+                       help='Pin the UDP client thread to this CPU, Linux only')
+    parser.add_argument('--server-cpu', type=int, metavar='CPU',
+                       help='Pin the local UDP server process to this CPU, Linux only')
+    parser.add_argument('--nice', type=int, default=0, metavar='N',
+                       help='Raise the UDP client priority by N (needs privileges)')
     
     args = parser.parse_args()
     
@@ -225,7 +284,19 @@ Examples:
         tcp_port=args.tcp_port,
         udp_port=args.udp_port,
         data_size=args.data_size,
-        iterations=args.iterations
+        iterations=args.iterations,
+        zerocopy=args.zerocopy,
+        pipeline=args.pipeline,
+        ping=args.ping,
+        pace_interval=args.pace_interval,
+        batch_size=args.batch_size,
+        busy_poll=args.busy_poll,
+        client_cpu=args.client_cpu,
+        server_cpu=args.server_cpu,
+        nice=args.nice,
+        window=args.window,
+        debug=args.debug,
+        iouring=args.iouring
     )
     
     try:
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Batched datagram I/O for socket benchmarks
+Thin ctypes wrapper around Linux recvmmsg(2) / sendmmsg(2)
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+
+MAX_BATCH_SIZE = 64  # Datagrams moved per recvmmsg/sendmmsg call
+MSG_WAITFORONE = 0x10000  # Block for the first datagram only, then return what is queued
+SOCKADDR_STORAGE_SIZE = 128  # sizeof(struct sockaddr_storage)
+
+class IOVec(ctypes.Structure):
+    """struct iovec"""
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+class MsgHdr(ctypes.Structure):
+    """struct msghdr"""
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class MMsgHdr(ctypes.Structure):
+    """struct mmsghdr"""
+    _fields_ = [
+        ('msg_hdr', MsgHdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+def _load_libc():
+    """Load libc with recvmmsg/sendmmsg prototypes, or return None if unsupported"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    # msgvec is passed as a raw address so batches can start at any offset
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return libc
+
+_libc = _load_libc()
+MMSG_AVAILABLE = _libc is not None
+
+def _call(func, *args):
+    """Call a libc function, retrying on EINTR and raising OSError on failure"""
+    while True:
+        ret = func(*args)
+        if ret >= 0:
+            return ret
+        err = ctypes.get_errno()
+        if err != errno.EINTR:
+            raise OSError(err, os.strerror(err))
+
+def _send_all(fd, msgvec, count):
+    """sendmmsg count headers starting at address msgvec, resuming after partial sends"""
+    size = ctypes.sizeof(MMsgHdr)
+    while count > 0:
+        sent = _call(_libc.sendmmsg, fd, msgvec, count, 0)
+        msgvec += sent * size
+        count -= sent
+
+class DatagramEchoBatch:
+    """Receives a batch of datagrams with one recvmmsg and echoes them back with one sendmmsg"""
+    def __init__(self, data_size, batch_size=MAX_BATCH_SIZE):
+        self.data_size = data_size
+        self.batch_size = batch_size
+
+        # One contiguous receive buffer and one sockaddr slot per datagram
+        self._rx_buf = ctypes.create_string_buffer(data_size * batch_size)
+        self._names = ctypes.create_string_buffer(SOCKADDR_STORAGE_SIZE * batch_size)
+        self._rx_iov = (IOVec * batch_size)()
+        self._rx = (MMsgHdr * batch_size)()
+        self._tx = (MMsgHdr * batch_size)()
+        self._rx_addr = ctypes.addressof(self._rx)
+        self._tx_addr = ctypes.addressof(self._tx)
+        self._used = batch_size  # Headers whose msg_namelen the kernel may have shrunk
+
+        rx_base = ctypes.addressof(self._rx_buf)
+        name_base = ctypes.addressof(self._names)
+        for i in range(batch_size):
+            self._rx_iov[i].iov_base = rx_base + i * data_size
+            self._rx_iov[i].iov_len = data_size
+
+            # Replies carry the request bytes back to the address they came from
+            for hdr in (self._rx[i].msg_hdr, self._tx[i].msg_hdr):
+                hdr.msg_iov = ctypes.pointer(self._rx_iov[i])
+                hdr.msg_name = name_base + i * SOCKADDR_STORAGE_SIZE
+                hdr.msg_iovlen = 1
+
+    def echo(self, fd, flags=MSG_WAITFORONE):
+        """Receive up to batch_size datagrams on fd and reply to every full-size one"""
+        rx = self._rx
+        tx = self._tx
+        for i in range(self._used):
+            rx[i].msg_hdr.msg_namelen = SOCKADDR_STORAGE_SIZE
+
+        count = _call(_libc.recvmmsg, fd, self._rx_addr, self.batch_size, flags, None)
+        self._used = count
+
+        full = 0
+        for i in range(count):
+            tx[i].msg_hdr.msg_namelen = rx[i].msg_hdr.msg_namelen
+            if rx[i].msg_len == self.data_size:
+                full += 1
+
+        if full == count:
+            self._send(fd, 0, count)
+        else:
+            # Rare path: skip short datagrams one header at a time
+            for i in range(count):
+                if rx[i].msg_len == self.data_size:
+                    self._send(fd, i, 1)
+        return count
+
+    def _send(self, fd, start, count):
+        """Send tx headers [start, start + count)"""
+        _send_all(fd, self._tx_addr + start * ctypes.sizeof(MMsgHdr), count)
+
+class DatagramBatch:
+    """Client side: sends a batch of requests with one sendmmsg and gathers the replies with recvmmsg
+
+    The socket must be connected and blocking, headers carry no address.
+    """
+    def __init__(self, payload, data_size, batch_size):
+        self.data_size = data_size
+        self.batch_size = batch_size
+
+        self._payload = ctypes.create_string_buffer(bytes(payload), len(payload))
+        self._rx_buf = ctypes.create_string_buffer(data_size * batch_size)
+        self._tx_iov = IOVec(ctypes.addressof(self._payload), len(payload))
+        self._rx_iov = (IOVec * batch_size)()
+        self._rx = (MMsgHdr * batch_size)()
+        self._tx = (MMsgHdr * batch_size)()
+        self._rx_addr = ctypes.addressof(self._rx)
+        self._tx_addr = ctypes.addressof(self._tx)
+
+        rx_base = ctypes.addressof(self._rx_buf)
+        for i in range(batch_size):
+            self._rx_iov[i].iov_base = rx_base + i * data_size
+            self._rx_iov[i].iov_len = data_size
+            self._rx[i].msg_hdr.msg_iov = ctypes.pointer(self._rx_iov[i])
+            self._rx[i].msg_hdr.msg_iovlen = 1
+            self._tx[i].msg_hdr.msg_iov = ctypes.pointer(self._tx_iov)
+            self._tx[i].msg_hdr.msg_iovlen = 1
+
+    def exchange(self, fd, count):
+        """Send count requests, wait for count replies and return how many were full-size"""
+        _send_all(fd, self._tx_addr, count)
+
+        rx = self._rx
+        size = ctypes.sizeof(MMsgHdr)
+        received = 0
+        while received < count:
+            received += _call(_libc.recvmmsg, fd, self._rx_addr + received * size,
+                              count - received, MSG_WAITFORONE, None)
+
+        data_size = self.data_size
+        return sum(1 for i in range(count) if rx[i].msg_len == data_size)
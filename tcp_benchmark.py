@@ -1,17 +1,41 @@
+import array
 import asyncio
+import select
 import time
-import statistics
 import socket
 import struct
+from common import (MSG_ZEROCOPY, PROGRESS_INTERVAL, SO_ZEROCOPY, ZEROCOPY_DRAIN_INTERVAL, drain_zerocopy_completions,
+                    install_uvloop, latency_stats, make_payload, print_benchmark_results, print_progress,
+                    set_kernel_timeout)
+
+SOCKET_BUFFER_SIZE = 1 << 20  # 1MiB kernel send/receive buffers
+SERVER_IDLE_TIMEOUT = 5.0  # Seconds a client may go without a request before the server drops it
+
+def tune_tcp_socket(sock):
+    """Disable Nagle's algorithm and enlarge kernel buffers for ping-pong traffic"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    # Linux only: ACK immediately instead of waiting for the delayed-ACK timer
+    if hasattr(socket, 'TCP_QUICKACK'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
 
 class TCPBenchmark:
-    def __init__(self, host='localhost', port=8888, data_size=1024, iterations=1000):
+    def __init__(self, host='localhost', port=8888, data_size=1024, iterations=1000, zerocopy=False,
+                 pipeline=1):
         self.host = host
         self.port = port
         self.data_size = data_size  # 1KiB
         self.iterations = iterations
-        self.test_data = b'x' * data_size
-        self.results = []
+        self.zerocopy = zerocopy  # MSG_ZEROCOPY sends in the blocking client (Linux 4.14+)
+        self.pipeline = max(1, pipeline)  # Requests in flight before the client reads replies
+        self.test_data = make_payload(data_size)  # Shared with every benchmark of this size
+        # Round-trip times in integer nanoseconds, filled up to self._idx
+        self.results = array.array('q', [0] * iterations)
+        self._idx = 0
+        # Receive buffer shared by every blocking-client window, filled by recv_into
+        self._rxbuf = bytearray(data_size * self.pipeline)
+        self._rxmv = memoryview(self._rxbuf)
         
     async def tcp_server(self):
         """Async TCP server that receives data and sends back"""
@@ -36,31 +60,26 @@ class TCPBenchmark:
         """Handle individual client connections"""
         addr = writer.get_extra_info('peername')
         print(f"TCP Client connected: {addr}")
+        tune_tcp_socket(writer.get_extra_info('socket'))
         
+        progress = [0]  # Requests started so far, advanced by _echo
+        echo = asyncio.ensure_future(self._echo(reader, writer, addr, progress))
         try:
-            for i in range(self.iterations):
-                # Receive data with timeout
-                try:
-                    data = await asyncio.wait_for(
-                        reader.read(self.data_size),
-                        timeout=5.0
-                    )
-                except asyncio.TimeoutError:
-                    print(f"Warning: Timeout receiving data from client at iteration {i}")
+            # Idle timeout instead of a wait_for per call: the session is only dropped when
+            # no request starts for a whole check interval, so slow links still finish
+            seen = -1
+            while True:
+                done, _ = await asyncio.wait({echo}, timeout=SERVER_IDLE_TIMEOUT)
+                if done:
+                    echo.result()
                     break
-                if len(data) == 0:  # Client disconnected
-                    print(f"TCP Client disconnected early: {addr}")
-                    break
-                elif len(data) != self.data_size:
-                    print(f"Warning: Received {len(data)} bytes, expected {self.data_size}")
-                
-                # Send data back with timeout
-                try:
-                    writer.write(self.test_data)
-                    await asyncio.wait_for(writer.drain(), timeout=5.0)
-                except asyncio.TimeoutError:
-                    print(f"Warning: Timeout sending data to client at iteration {i}")
+                if progress[0] == seen:
+                    print(f"Warning: Timeout echoing data to client {addr}")
+                    echo.cancel()
+                    # Closing gracefully would wait forever on a client that stopped reading
+                    writer.transport.abort()
                     break
+                seen = progress[0]
                 
         except ConnectionResetError:
             print(f"TCP Client connection reset: {addr}")
@@ -69,6 +88,7 @@ class TCPBenchmark:
         except Exception as e:
             print(f"TCP Server error: {e}")
         finally:
+            echo.cancel()  # No-op once it finished, stops it if the handler itself was cancelled
             try:
                 writer.close()
                 await writer.wait_closed()
@@ -76,6 +96,24 @@ class TCPBenchmark:
                 print(f"Error closing writer: {e}")
             print(f"TCP Client disconnected: {addr}")
     
+    async def _echo(self, reader, writer, addr, progress):
+        """Server side of the request/response loop"""
+        write = writer.write
+        drain = writer.drain
+        readexactly = reader.readexactly
+        test_data = self.test_data
+        data_size = self.data_size
+        
+        try:
+            # Reply only once a whole request has arrived
+            for i in range(self.iterations):
+                progress[0] = i
+                await readexactly(data_size)
+                write(test_data)
+                await drain()
+        except asyncio.IncompleteReadError:  # Client disconnected
+            print(f"TCP Client disconnected early: {addr}")
+    
     async def tcp_client(self):
         """Async TCP client that sends data and receives response"""
         print(f"TCP Client connecting to {self.host}:{self.port}")
@@ -86,45 +124,18 @@ class TCPBenchmark:
                 asyncio.open_connection(self.host, self.port),
                 timeout=10.0
             )
+            tune_tcp_socket(writer.get_extra_info('socket'))
             
-            for i in range(self.iterations):
-                start_time = time.perf_counter()
-                
-                # Send data with timeout
-                try:
-                    writer.write(self.test_data)
-                    await asyncio.wait_for(writer.drain(), timeout=5.0)
-                except asyncio.TimeoutError:
-                    print(f"Warning: Timeout sending data at iteration {i}")
-                    break
-                
-                # Receive response with timeout
-                try:
-                    data = await asyncio.wait_for(
-                        reader.read(self.data_size),
-                        timeout=5.0
-                    )
-                except asyncio.TimeoutError:
-                    print(f"Warning: Timeout receiving data at iteration {i}")
-                    break
-                
-                end_time = time.perf_counter()
-                duration = (end_time - start_time) * 1000  # Convert to milliseconds
-                self.results.append(duration)
-                
-                if len(data) == 0:  # Server disconnected
-                    print(f"Warning: Server disconnected at iteration {i}")
-                    break
-                elif len(data) != self.data_size:
-                    print(f"Warning: Received {len(data)} bytes, expected {self.data_size}")
-                
-                # Progress indicator - update on same line every 10 iterations
-                if (i + 1) % 10 == 0 or (i + 1) == self.iterations:
-                    percent = ((i + 1) / self.iterations) * 100
-                    print(f"\r📊 TCP Progress: {percent:5.1f}% ({i + 1}/{self.iterations})", end="", flush=True)
-                
-                # Small delay to prevent overwhelming
-                await asyncio.sleep(0.001)
+            # One deadline for the whole run instead of a wait_for per call
+            try:
+                await asyncio.wait_for(
+                    self._ping_pong(reader, writer),
+                    timeout=30.0 + self.iterations * 0.01
+                )
+            except asyncio.TimeoutError:
+                print(f"Warning: Timeout after {self._idx} iterations")
+                # wait_closed() would wait forever to flush unsent data to a peer that stopped reading
+                writer.transport.abort()
             
             writer.close()
             await writer.wait_closed()
@@ -137,19 +148,203 @@ class TCPBenchmark:
             print(f"TCP Client error: Broken pipe")
         except Exception as e:
             print(f"TCP Client error: {e}")
+
+    async def _ping_pong(self, reader, writer):
+        """Timed request/response loop with attribute lookups hoisted into locals
+
+        Each window writes `pipeline` requests back to back and reads the replies
+        while they drain; every request in the window is charged an equal share of it.
+        """
+        perf = time.perf_counter_ns
+        writelines = writer.writelines
+        drain = writer.drain
+        readexactly = reader.readexactly
+        data_size = self.data_size
+        results = self.results
+        iterations = self.iterations
+        pipeline = self.pipeline
+        burst = [self.test_data] * pipeline
+        create_task = asyncio.ensure_future
+        monotonic = time.monotonic
+        
+        # Progress is refreshed by wall clock so fast runs do no per-iteration stdio
+        next_print = monotonic() + PROGRESS_INTERVAL
+        
+        for i in range(0, iterations, pipeline):
+            window = min(pipeline, iterations - i)
+            expected = window * data_size
+            start_time = perf()
+            writelines(burst if window == pipeline else burst[:window])
+            try:
+                if window > 1:
+                    # Read while the window drains: a window larger than the socket buffers
+                    # of both ends would otherwise leave client and server waiting on each other
+                    reply = create_task(readexactly(expected))
+                    try:
+                        await drain()
+                    except BaseException:
+                        reply.cancel()
+                        raise
+                    await reply
+                else:
+                    await drain()
+                    await readexactly(expected)
+            except asyncio.IncompleteReadError:  # Server disconnected
+                print(f"Warning: Server disconnected at iteration {i}")
+                break
+            duration = perf() - start_time
+            
+            share = duration // window
+            for j in range(i, i + window):
+                results[j] = share
+            self._idx = i + window
+            
+            # Progress indicator - update on same line every PROGRESS_INTERVAL seconds
+            now = monotonic()
+            if now >= next_print:
+                print_progress("TCP", self._idx, iterations)
+                next_print = now + PROGRESS_INTERVAL
+        
+        print_progress("TCP", self._idx, iterations)
+
+    def tcp_client_sync(self):
+        """Blocking TCP client that sends data and receives response without event loop overhead"""
+        print(f"TCP Client connecting to {self.host}:{self.port}")
+
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=10.0)
+        except ConnectionRefusedError:
+            print(f"TCP Client error: Connection refused to {self.host}:{self.port}")
+            return
+        except Exception as e:
+            print(f"TCP Client error: {e}")
+            return
+
+        try:
+            tune_tcp_socket(sock)
+            set_kernel_timeout(sock, 5.0)  # 5 second timeout
+
+            # Pin test_data pages for the NIC instead of copying them per send
+            zerocopy = self.zerocopy
+            if zerocopy:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+                except OSError as e:
+                    print(f"Warning: MSG_ZEROCOPY unavailable, using regular sends: {e}")
+                    zerocopy = False
+
+            perf = time.perf_counter_ns
+            view = self._rxmv
+            data_size = self.data_size
+            pipeline = self.pipeline
+            burst = make_payload(data_size * pipeline)  # One send per window of pipelined requests
+            monotonic = time.monotonic
+            next_print = monotonic() + PROGRESS_INTERVAL
+
+            for window_no, i in enumerate(range(0, self.iterations, pipeline)):
+                window = min(pipeline, self.iterations - i)
+                expected = window * data_size
+                payload = burst if window == pipeline else burst[:expected]
+                start_time = perf()
+
+                try:
+                    if window > 1:
+                        received = self._send_window(sock, payload, view[:expected], zerocopy)
+                    elif zerocopy:
+                        sent = sock.sendmsg([payload], [], MSG_ZEROCOPY)
+                        if sent < expected:
+                            sock.sendall(payload[sent:])
+                        received = 0
+                    else:
+                        sock.sendall(payload)
+                        received = 0
+                    while received < expected:
+                        n = sock.recv_into(view[received:expected])
+                        if n == 0:  # Server disconnected
+                            break
+                        received += n
+                except (socket.timeout, BlockingIOError):
+                    print(f"Warning: Timeout at iteration {i}")
+                    break
+
+                duration = perf() - start_time
+
+                if received < expected:
+                    print(f"Warning: Server disconnected at iteration {i}")
+                    break
+
+                share = duration // window
+                for j in range(i, i + window):
+                    self.results[j] = share
+                self._idx = i + window
+
+                # Completions must be reaped or the socket runs out of option memory
+                if zerocopy and window_no % ZEROCOPY_DRAIN_INTERVAL == 0:
+                    drain_zerocopy_completions(sock)
+
+                # Progress indicator - update on same line every PROGRESS_INTERVAL seconds
+                now = monotonic()
+                if now >= next_print:
+                    print_progress("TCP", self._idx, self.iterations)
+                    next_print = now + PROGRESS_INTERVAL
+
+            print_progress("TCP", self._idx, self.iterations)
+
+        except ConnectionResetError:
+            print("TCP Client error: Connection reset by server")
+        except BrokenPipeError:
+            print("TCP Client error: Broken pipe")
+        except Exception as e:
+            print(f"TCP Client error: {e}")
+        finally:
+            sock.close()
+
+    def _send_window(self, sock, payload, view, zerocopy):
+        """Send a pipelined window while reading the replies that arrive meanwhile
+
+        Writing the whole window before reading would deadlock once it outgrows the
+        socket buffers of both ends. Returns the number of reply bytes already in view.
+        """
+        payload = memoryview(payload)
+        expected = len(payload)
+        sent = received = 0
+        sock.setblocking(False)
+        try:
+            while sent < expected:
+                readable, writable, _ = select.select([sock], [sock], [], 5.0)
+                if not (readable or writable):
+                    raise socket.timeout("timed out")
+                if readable:
+                    try:
+                        n = sock.recv_into(view[received:])
+                    except BlockingIOError:
+                        # Queued zero-copy completions also poll readable; reap them
+                        drain_zerocopy_completions(sock)
+                    else:
+                        if n == 0:  # Server disconnected
+                            break
+                        received += n
+                if writable:
+                    try:
+                        if zerocopy:
+                            sent += sock.sendmsg([payload[sent:]], [], MSG_ZEROCOPY)
+                        else:
+                            sent += sock.send(payload[sent:])
+                    except BlockingIOError:
+                        pass
+        finally:
+            sock.setblocking(True)  # SO_RCVTIMEO/SO_SNDTIMEO still apply
+        return received
     
     def get_result(self):
         """Get benchmark results as a dictionary"""
-        if not self.results:
+        count = self._idx
+        if not count:
             return None
             
-        total_time = sum(self.results)
-        avg_time = statistics.mean(self.results)
-        min_time = min(self.results)
-        max_time = max(self.results)
-        std_dev = statistics.stdev(self.results) if len(self.results) > 1 else 0
+        total_time, avg_time, min_time, max_time, std_dev = latency_stats(self.results[:count])
         
-        total_data = self.iterations * self.data_size * 2  # Send + receive
+        total_data = count * self.data_size * 2  # Send + receive, completed requests only
         throughput = (total_data / 1024 / 1024) / (total_time / 1000)  # MB/s
         
         return {
@@ -169,20 +364,8 @@ class TCPBenchmark:
         if not result:
             print("No results to display")
             return
-            
-        print("\n" + "="*50)
-        print("TCP SOCKET BENCHMARK RESULTS")
-        print("="*50)
-        print(f"Data size per transfer: {self.data_size} bytes (1KiB)")
-        print(f"Total iterations: {self.iterations}")
-        print(f"Total data transferred: {result['total_data_mb']:.2f} MB")
-        print(f"Total time: {result['total_time']:.2f} ms")
-        print(f"Average time per transfer: {result['avg_time']:.3f} ms")
-        print(f"Min time: {result['min_time']:.3f} ms")
-        print(f"Max time: {result['max_time']:.3f} ms")
-        print(f"Standard deviation: {result['std_dev']:.3f} ms")
-        print(f"Throughput: {result['throughput']:.2f} MB/s")
-        print("="*50)
+        
+        print_benchmark_results("TCP", self.data_size, self.iterations, result)
 
 async def run_tcp_benchmark():
     """Run TCP benchmark with server and client"""
@@ -204,4 +387,5 @@ async def run_tcp_benchmark():
     benchmark.print_results()
 
 if __name__ == "__main__":
+    install_uvloop()
     asyncio.run(run_tcp_benchmark()) 
\ No newline at end of file
@@ -1,93 +1,399 @@
+import array
+import multiprocessing
+import select
 import socket
 import time
-import statistics
 import struct
 import threading
+from common import (MSG_ZEROCOPY, MS_PER_NS, PROGRESS_INTERVAL, SO_ZEROCOPY, ZEROCOPY_DRAIN_INTERVAL, clock_ns,
+                    drain_zerocopy_completions, enable_busy_poll, latency_stats, make_payload, print_benchmark_results,
+                    print_progress, set_kernel_timeout, tune_scheduling)
+from mmsg import DatagramBatch, DatagramEchoBatch, MMSG_AVAILABLE
+from uring import UringPingPong
+
+SOCKET_BUFFER_SIZE = 4 << 20  # 4MiB kernel buffers absorb bursts without drops
+SEQUENCE = struct.Struct('<I')  # Tag in the first bytes of windowed requests
+
+def tune_udp_socket(sock, rcvbuf=SOCKET_BUFFER_SIZE, sndbuf=SOCKET_BUFFER_SIZE):
+    """Enlarge kernel send/receive buffers for datagram echo traffic, 0 keeps the OS default"""
+    for option, name, limit, size in ((socket.SO_RCVBUF, 'SO_RCVBUF', 'rmem_max', rcvbuf),
+                                      (socket.SO_SNDBUF, 'SO_SNDBUF', 'wmem_max', sndbuf)):
+        if not size:
+            continue
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+        # Linux silently clamps to net.core.rmem_max/wmem_max (and reports double the value)
+        effective = sock.getsockopt(socket.SOL_SOCKET, option)
+        if effective < size:
+            print(f"⚠️ UDP {name} capped at {effective} bytes (requested {size}), raise net.core.{limit}")
+
+def udp_server_main(host, port, data_size, stop, ready, options):
+    """Server process entry point: run UDPBenchmark.udp_server until stop is set"""
+    benchmark = UDPBenchmark(host, port, data_size, 0, **options)
+    benchmark.ready = ready  # Shared with the parent, set once the socket is bound
+    
+    # Waiting on the multiprocessing.Event costs a semaphore round trip, so the
+    # echo loop keeps checking a plain attribute that this thread clears
+    def watch_stop():
+        stop.wait()
+        benchmark.stop_server()
+    
+    threading.Thread(target=watch_stop, daemon=True).start()
+    benchmark.udp_server()
 
 class UDPBenchmark:
-    def __init__(self, host='localhost', port=8889, data_size=1024, iterations=1000):
+    def __init__(self, host='localhost', port=8889, data_size=1024, iterations=1000,
+                 rcvbuf=SOCKET_BUFFER_SIZE, sndbuf=SOCKET_BUFFER_SIZE, pace_interval=0,
+                 batch_size=1, busy_poll=0, client_cpu=None, server_cpu=None, nice=0, zerocopy=False,
+                 window=1, debug=False, iouring=False):
         self.host = host
         self.port = port
         self.data_size = data_size  # 1KiB
         self.iterations = iterations
-        self.test_data = b'x' * data_size
-        self.results = []
+        self.rcvbuf = rcvbuf  # Kernel buffer sizes for both sockets, 0 keeps the OS default
+        self.sndbuf = sndbuf
+        self.pace_interval = pace_interval  # Seconds between request starts, 0 sends back to back
+        self.batch_size = max(1, batch_size)  # Requests per sendmmsg/recvmmsg round trip (Linux)
+        self.busy_poll = busy_poll  # SO_BUSY_POLL microseconds on both sockets, 0 leaves it off
+        self.client_cpu = client_cpu  # CPUs the client and server threads are pinned to (Linux)
+        self.server_cpu = server_cpu
+        self.nice = nice  # Priority boost for the client thread, needs privileges
+        self.zerocopy = zerocopy  # MSG_ZEROCOPY replies from udp_server (Linux 5.0+)
+        self.window = max(1, window)  # Tagged datagrams in flight per round trip
+        self.debug = debug  # Check every reply size inside the timed loop
+        self.iouring = iouring  # One linked io_uring submission per client round trip (Linux 6.1+)
+        self.test_data = make_payload(data_size)  # Shared with every benchmark of this size
+        # Round-trip times in integer nanoseconds, filled up to self._idx
+        self.results = array.array('q', [0] * iterations)
+        self._idx = 0
+        self._wall_ns = 0  # Elapsed run time when windows overlap round trips
         self.server_running = False
+        self.ready = threading.Event()  # Set by udp_server once it can receive
+        self._server_sock = None
+        self._server_process = None
+        self._server_stop = None
         
+    def start_server_process(self):
+        """Run udp_server in a child process so client and server use separate cores and GILs"""
+        options = {'rcvbuf': self.rcvbuf, 'sndbuf': self.sndbuf, 'busy_poll': self.busy_poll,
+                   'server_cpu': self.server_cpu, 'zerocopy': self.zerocopy,
+                   'window': self.window, 'batch_size': self.batch_size}
+        self._server_stop = multiprocessing.Event()
+        self.ready = multiprocessing.Event()
+        self._server_process = multiprocessing.Process(
+            target=udp_server_main,
+            args=(self.host, self.port, self.data_size, self._server_stop, self.ready, options),
+            daemon=True
+        )
+        self._server_process.start()
+    
+    def wait_server_ready(self, timeout=5.0):
+        """Block until the server socket is bound, warn and return False after timeout seconds"""
+        if self.ready.wait(timeout):
+            return True
+        print(f"⚠️ UDP server not ready after {timeout:.0f} s, starting the client anyway")
+        return False
+    
+    def stop_server_process(self):
+        """Signal the server process to stop and wait for it"""
+        self._server_stop.set()
+        self._server_process.join(timeout=2)
+        if self._server_process.is_alive():  # Stop arrived before the socket was bound
+            self._server_process.terminate()
+            self._server_process.join()
+        
+    def stop_server(self):
+        """Clear server_running and wake udp_server from its blocking receive"""
+        self.server_running = False
+        sock = self._server_sock
+        if sock is not None:
+            try:
+                # An empty datagram is never a full-size request, so the loop re-checks the flag
+                sock.sendto(b'', sock.getsockname())
+            except OSError:  # Already closed
+                pass
+    
     def udp_server(self):
         """UDP server that receives data and sends back"""
+        tune_scheduling(self.server_cpu)
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        tune_udp_socket(sock, self.rcvbuf, self.sndbuf)
+        if self.busy_poll:
+            enable_busy_poll(sock, self.busy_poll)
         sock.bind((self.host, self.port))
+        self._server_sock = sock
         
         print(f"UDP Server listening on {self.host}:{self.port}")
         self.server_running = True
         
+        # Datagrams land in one preallocated buffer instead of a new bytes object each
+        data_size = self.data_size
+        view = memoryview(bytearray(data_size))
+        recvfrom_into = sock.recvfrom_into
+        sendto = sock.sendto
+        
+        # Zero-copy replies pin the pages of the immutable payload, not the receive
+        # buffer, which the next datagram overwrites before the send completes
+        zerocopy = self.zerocopy
+        if zerocopy:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+            except OSError as e:
+                print(f"Warning: MSG_ZEROCOPY unavailable, using regular sends: {e}")
+                zerocopy = False
+        test_data = self.test_data
+        sent = 0
+        self.ready.set()
+        
+        # Bursts only arrive when the client keeps several requests in flight; for plain
+        # ping-pong the blocking recvfrom/sendto pair below is the shorter path
+        bursts = self.window > 1 or self.batch_size > 1
+        drain = bursts and not zerocopy and MMSG_AVAILABLE and hasattr(select, 'epoll')
+        
+        try:
+            if drain:
+                self._serve_epoll(sock)
+            else:
+                while self.server_running:
+                    try:
+                        n, addr = recvfrom_into(view, data_size)
+                        if n == data_size:
+                            if zerocopy:
+                                sendto(test_data, MSG_ZEROCOPY, addr)
+                                sent += 1
+                                # Completions must be reaped or the socket runs out of option memory
+                                if sent % ZEROCOPY_DRAIN_INTERVAL == 0:
+                                    drain_zerocopy_completions(sock)
+                            else:
+                                # Echo the received bytes back; n == data_size, so no slice is needed
+                                sendto(view, addr)
+                    except Exception as e:
+                        if self.server_running:
+                            print(f"UDP Server error: {e}")
+                        break
+        finally:
+            self._server_sock = None
+            sock.close()
+            print("\nUDP Server stopped")  # Below the client's progress line
+    
+    def _serve_epoll(self, sock):
+        """Echo loop for Linux: one edge-triggered epoll wakeup per burst, drained with recvmmsg/sendmmsg"""
+        fd = sock.fileno()
+        sock.setblocking(False)
+        batch = DatagramEchoBatch(self.data_size)
+        echo = batch.echo
+        batch_size = batch.batch_size
+        poller = select.epoll()
+        poller.register(fd, select.EPOLLIN | select.EPOLLET)
+        
         try:
             while self.server_running:
+                poller.poll()
                 try:
-                    data, addr = sock.recvfrom(self.data_size)
-                    if len(data) == self.data_size:
-                        # Send data back
-                        sock.sendto(self.test_data, addr)
-                except socket.timeout:
-                    continue
+                    # A short batch means the queue was empty, so the next datagram raises a new edge
+                    while echo(fd) == batch_size:
+                        pass
+                except BlockingIOError:  # Drained exactly at a batch boundary
+                    pass
                 except Exception as e:
                     if self.server_running:
                         print(f"UDP Server error: {e}")
                     break
         finally:
-            sock.close()
-            print("UDP Server stopped")
+            poller.close()
     
     def udp_client(self):
         """UDP client that sends data and receives response"""
+        tune_scheduling(self.client_cpu, self.nice)
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(5.0)  # 5 second timeout
+        tune_udp_socket(sock, self.rcvbuf, self.sndbuf)
+        if self.busy_poll:
+            enable_busy_poll(sock, self.busy_poll)
+        # Kernel timeout: a Python-level one would poll() before every send and recv
+        set_kernel_timeout(sock, 5.0)  # 5 second timeout
         
         print(f"UDP Client connecting to {self.host}:{self.port}")
         
+        batch_size = self.batch_size
+        if batch_size > 1 and not MMSG_AVAILABLE:
+            print("Warning: sendmmsg/recvmmsg unavailable, sending one datagram per call")
+            batch_size = 1
+        window = self.window
+        if window > 1 and self.data_size < SEQUENCE.size:
+            print(f"Warning: --window needs at least {SEQUENCE.size}-byte datagrams, sending one at a time")
+            window = 1
+        if batch_size > 1 and window > 1:
+            print(f"Warning: --batch-size {batch_size} replaces --window {window}, ignoring --window")
+            window = 1
+        if self.iouring and (batch_size > 1 or window > 1):
+            print("⚠️ io_uring only runs one request at a time, using socket calls for --batch-size/--window")
+        
         try:
-            for i in range(self.iterations):
-                start_time = time.perf_counter()
-                
-                # Send data
-                sock.sendto(self.test_data, (self.host, self.port))
-                
-                # Receive response
-                data, addr = sock.recvfrom(self.data_size)
-                
-                end_time = time.perf_counter()
-                duration = (end_time - start_time) * 1000  # Convert to milliseconds
-                self.results.append(duration)
-                
-                if len(data) != self.data_size:
-                    print(f"Warning: Received {len(data)} bytes, expected {self.data_size}")
-                
-                # Progress indicator - update on same line every 10 iterations
-                if (i + 1) % 10 == 0 or (i + 1) == self.iterations:
-                    percent = ((i + 1) / self.iterations) * 100
-                    print(f"\r📊 UDP Progress: {percent:5.1f}% ({i + 1}/{self.iterations})", end="", flush=True)
-                
-                # Small delay to prevent overwhelming
-                time.sleep(0.001)
+            # Fix the peer once: no route lookup per send, no address tuple per receive
+            sock.connect((self.host, self.port))
+            
+            if batch_size > 1:
+                self._run_rounds(self._batch_step(sock, batch_size), batch_size)
+            elif window > 1:
+                self._run_rounds(self._window_step(sock), window)
+            else:
+                pingpong = None
+                if self.iouring:
+                    try:
+                        pingpong = UringPingPong(sock, self.test_data, self.data_size, timeout=5.0)
+                    except OSError as e:
+                        print(f"⚠️ io_uring unavailable, using socket calls: {e}")
+                try:
+                    self._run_rounds(self._pingpong_step(sock, pingpong), 1)
+                finally:
+                    if pingpong is not None:
+                        pingpong.close()
                 
+        except (socket.timeout, BlockingIOError):
+            print(f"Warning: Timeout after {self._idx} iterations")
         except Exception as e:
             print(f"UDP Client error: {e}")
         finally:
             sock.close()
     
+    def _run_rounds(self, step, round_size):
+        """Call step(i, count) for rounds of up to round_size requests until every iteration ran
+
+        Steps time their own requests into self.results; progress and pacing are shared here.
+        """
+        iterations = self.iterations
+        pace_interval = self.pace_interval
+        next_deadline = time.perf_counter()
+        monotonic = time.monotonic
+        next_print = monotonic() + PROGRESS_INTERVAL
+        
+        for i in range(0, iterations, round_size):
+            count = round_size if i + round_size <= iterations else iterations - i
+            step(i, count)
+            self._idx = i + count
+            
+            # Progress indicator - update on same line every PROGRESS_INTERVAL seconds
+            now = monotonic()
+            if now >= next_print:
+                print_progress("UDP", self._idx, iterations)
+                next_print = now + PROGRESS_INTERVAL
+            
+            # Optional pacing against absolute deadlines so sleep overshoot does not accumulate
+            if pace_interval:
+                next_deadline += pace_interval * count
+                remaining = next_deadline - time.perf_counter()
+                if remaining > 0:
+                    time.sleep(remaining)
+        
+        print_progress("UDP", self._idx, iterations)
+    
+    def _pingpong_step(self, sock, pingpong=None):
+        """Step timing one request/reply, through a UringPingPong when given, else send/recv_into"""
+        perf = clock_ns
+        results = self.results
+        data_size = self.data_size
+        debug = self.debug
+        
+        if pingpong is not None:
+            exchange = pingpong.exchange
+            
+            def step(i, count):
+                start_time = perf()
+                n = exchange()
+                results[i] = perf() - start_time
+                if debug and n != data_size:
+                    print(f"Warning: Received {n} bytes, expected {data_size}")
+            return step
+        
+        send = sock.send
+        recv_into = sock.recv_into
+        test_data = self.test_data
+        view = memoryview(bytearray(data_size))  # Reused by every reply
+        
+        def step(i, count):
+            start_time = perf()
+            send(test_data)
+            n = recv_into(view)
+            results[i] = perf() - start_time
+            # Datagrams arrive whole and view fits one exactly, so only check on request
+            if debug and n != data_size:
+                print(f"Warning: Received {n} bytes, expected {data_size}")
+        return step
+    
+    def _batch_step(self, sock, batch_size):
+        """Step moving count datagrams per sendmmsg/recvmmsg exchange on the connected socket"""
+        exchange = DatagramBatch(self.test_data, self.data_size, batch_size).exchange
+        fd = sock.fileno()
+        results = self.results
+        data_size = self.data_size
+        
+        def step(i, count):
+            start_time = clock_ns()
+            full = exchange(fd, count)
+            # Every datagram in the batch is charged an equal share of it
+            share = (clock_ns() - start_time) // count
+            for j in range(i, i + count):
+                results[j] = share
+            if full != count:
+                print(f"Warning: {count - full} of {count} replies were not {data_size} bytes")
+        return step
+    
+    def _window_step(self, sock):
+        """Step sending count sequence-tagged datagrams before reading their replies
+
+        Latency is taken per datagram from its own send and receive timestamps.
+        """
+        clock = clock_ns
+        send = sock.send
+        recv_into = sock.recv_into
+        pack_into = SEQUENCE.pack_into
+        unpack_from = SEQUENCE.unpack_from
+        data_size = self.data_size
+        debug = self.debug
+        request = bytearray(self.test_data)  # Writable copy that carries the tag
+        view = memoryview(bytearray(data_size))
+        results = self.results
+        t_send = array.array('q', [0] * self.iterations)
+        t_recv = array.array('q', [0] * self.iterations)
+        started = clock()
+        
+        def step(i, count):
+            end = i + count
+            for seq in range(i, end):
+                pack_into(request, 0, seq)
+                t_send[seq] = clock()
+                send(request)
+            
+            fifo = i
+            for _ in range(i, end):
+                n = recv_into(view)
+                now = clock()
+                if debug and n != data_size:
+                    print(f"Warning: Received {n} bytes, expected {data_size}")
+                seq = unpack_from(view)[0]
+                if not i <= seq < end or t_recv[seq]:
+                    # Server replied with its own payload, match replies in arrival order
+                    while t_recv[fifo]:
+                        fifo += 1
+                    seq = fifo
+                t_recv[seq] = now
+            
+            for seq in range(i, end):
+                results[seq] = t_recv[seq] - t_send[seq]
+            self._wall_ns = clock() - started
+        return step
+    
     def get_result(self):
         """Get benchmark results as a dictionary"""
-        if not self.results:
+        count = self._idx
+        if not count:
             return None
             
-        total_time = sum(self.results)
-        avg_time = statistics.mean(self.results)
-        min_time = min(self.results)
-        max_time = max(self.results)
-        std_dev = statistics.stdev(self.results) if len(self.results) > 1 else 0
+        total_time, avg_time, min_time, max_time, std_dev = latency_stats(self.results[:count])
+        if self._wall_ns:
+            # Overlapping round trips: per-datagram latencies sum to more than the run took
+            total_time = self._wall_ns * MS_PER_NS
         
-        total_data = self.iterations * self.data_size * 2  # Send + receive
+        total_data = count * self.data_size * 2  # Send + receive, completed requests only
         throughput = (total_data / 1024 / 1024) / (total_time / 1000)  # MB/s
         
         return {
@@ -107,41 +413,24 @@ class UDPBenchmark:
         if not result:
             print("No results to display")
             return
-            
-        print("\n" + "="*50)
-        print("UDP SOCKET BENCHMARK RESULTS")
-        print("="*50)
-        print(f"Data size per transfer: {self.data_size} bytes (1KiB)")
-        print(f"Total iterations: {self.iterations}")
-        print(f"Total data transferred: {result['total_data_mb']:.2f} MB")
-        print(f"Total time: {result['total_time']:.2f} ms")
-        print(f"Average time per transfer: {result['avg_time']:.3f} ms")
-        print(f"Min time: {result['min_time']:.3f} ms")
-        print(f"Max time: {result['max_time']:.3f} ms")
-        print(f"Standard deviation: {result['std_dev']:.3f} ms")
-        print(f"Throughput: {result['throughput']:.2f} MB/s")
-        print("="*50)
+        
+        print_benchmark_results("UDP", self.data_size, self.iterations, result)
 
 def run_udp_benchmark():
     """Run UDP benchmark with server and client"""
     benchmark = UDPBenchmark()
     
-    # Start server in background thread
-    server_thread = threading.Thread(target=benchmark.udp_server)
-    server_thread.daemon = True
-    server_thread.start()
+    # Start server in a separate process
+    benchmark.start_server_process()
     
-    # Wait a bit for server to start
-    time.sleep(1)
+    # Wait for the server socket to be bound
+    benchmark.wait_server_ready()
     
     # Run client
     benchmark.udp_client()
     
     # Stop server
-    benchmark.server_running = False
-    
-    # Wait for server to stop
-    server_thread.join(timeout=2)
+    benchmark.stop_server_process()
     
     # Print results
     benchmark.print_results()